@@ -11,12 +11,20 @@ Author: Jedidja
 
 import pandas as pd
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Non-interactive backend; plots are only saved to disk
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
 from datetime import datetime
 import logging
 
+# Skip interactive mode and simplify long line paths when rasterizing
+plt.ioff()
+plt.rcParams['path.simplify'] = True
+plt.rcParams['path.simplify_threshold'] = 1.0
+plt.rcParams['agg.path.chunksize'] = 10000
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,6 +33,11 @@ logger = logging.getLogger(__name__)
 DATA_DIR = "../data"
 PLOTS_DIR = "../analysis/plots"
 
+# Only these columns are used downstream; years 2000-2024 fit in Int16,
+# which stays nullable because cleaning coerces bad years to NA
+COLUMNS = ['Country', 'Year', 'Value']
+DTYPES = {'Country': 'category', 'Year': 'Int16', 'Value': 'float32'}
+
 def ensure_dirs():
     """Ensure output directories exist"""
     os.makedirs(PLOTS_DIR, exist_ok=True)
@@ -32,16 +45,58 @@ def ensure_dirs():
 def load_data():
     """Load the analytics-ready data"""
     latest_file = os.path.join(DATA_DIR, "cleaned_data_latest.csv")
+    parquet_file = os.path.join(DATA_DIR, "cleaned_data_latest.parquet")
     
-    if not os.path.exists(latest_file):
+    # Prefer the typed parquet copy written by the cleaning step
+    if os.path.exists(parquet_file):
+        logger.info(f"Loading data from {parquet_file}")
+        df = pd.read_parquet(parquet_file, columns=COLUMNS, dtype_backend='pyarrow').astype(DTYPES)
+    elif os.path.exists(latest_file):
+        logger.info(f"Loading data from {latest_file}")
+        df = pd.read_csv(latest_file, engine='pyarrow', dtype_backend='pyarrow', usecols=COLUMNS, dtype=DTYPES)
+    else:
         logger.error(f"Data file not found: {latest_file}")
         return None
     
-    logger.info(f"Loading data from {latest_file}")
-    df = pd.read_csv(latest_file)
-    return df
+    # Rows without a year cannot be placed on any trend line
+    return df.dropna(subset=['Year'])
+
+def compute_global_average(df):
+    """Calculate the global average connectivity value for each year"""
+    # Year is a small integer domain, so bin rows by their offset from the
+    # first year in a single unsorted pass instead of building a GroupBy
+    has_year = df['Year'].notna().to_numpy()
+    years = df['Year'].to_numpy(dtype=np.int64, na_value=0)[has_year]
+    values = df['Value'].to_numpy(dtype=float, na_value=np.nan)[has_year]
+    if years.size == 0:
+        return pd.DataFrame({'Year': years, 'Value': values})
+    
+    first_year = years.min()
+    offsets = years - first_year
+    present = np.bincount(offsets) > 0
+    valid = ~np.isnan(values)
+    sums = np.bincount(offsets, weights=np.where(valid, values, 0.0))
+    counts = np.bincount(offsets, weights=valid)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    return pd.DataFrame({'Year': np.flatnonzero(present) + first_year, 'Value': means[present]})
+
+def select_country(df, country):
+    """Return the rows for a single country, ordered by year"""
+    countries = df['Country']
+    if isinstance(countries.dtype, pd.CategoricalDtype):
+        # Compare integer category codes instead of strings
+        categories = countries.cat.categories
+        if country not in categories:
+            return df.iloc[0:0]
+        mask = countries.cat.codes.to_numpy() == categories.get_loc(country)
+    else:
+        mask = (countries == country).to_numpy()
+    
+    country_data = df[mask]
+    return country_data.iloc[np.argsort(country_data['Year'].to_numpy(), kind='stable')]
 
-def create_visualizations(df):
+def create_visualizations(df, global_avg=None):
     """Create visualizations for the EDA results"""
     if df is None or df.empty:
         logger.error("No data for visualizations")
@@ -50,48 +105,45 @@ def create_visualizations(df):
     logger.info("Creating visualizations")
     ensure_dirs()
     
+    # Global average is shared by the global trend and Namibia plots
+    if global_avg is None:
+        global_avg = compute_global_average(df)
+    
     visualizations = []
     
     # Set the style
     sns.set(style="whitegrid")
     
+    # Reuse one figure for every plot, clearing it in between
+    fig, ax = plt.subplots(figsize=(12, 8))
+    
     # 1. Global trend over time
-    try:
-        plt.figure(figsize=(12, 8))
-        global_avg = df.groupby('Year')['Value'].mean().reset_index()
-        plt.plot(global_avg['Year'], global_avg['Value'], marker='o', linewidth=2)
-        plt.title('Global Average Connectivity Percentage (2000-2024)')
-        plt.xlabel('Year')
-        plt.ylabel('Connectivity Percentage')
-        plt.grid(True, alpha=0.3)
-        
-        filename = os.path.join(PLOTS_DIR, 'global_trend.png')
-        plt.savefig(filename)
-        plt.close()
-        visualizations.append(filename)
-    except Exception as e:
-        logger.error(f"Error creating global trend visualization: {e}")
+    ax.plot(global_avg['Year'], global_avg['Value'], marker='o', linewidth=2)
+    ax.set_title('Global Average Connectivity Percentage (2000-2024)')
+    ax.set_xlabel('Year')
+    ax.set_ylabel('Connectivity Percentage')
+    ax.grid(True, alpha=0.3)
+    
+    filename = os.path.join(PLOTS_DIR, 'global_trend.png')
+    fig.savefig(filename)
+    visualizations.append(filename)
     
     # 2. Namibia trend
-    try:
-        namibia_data = df[df['Country'] == 'Namibia'].sort_values('Year')
-        if not namibia_data.empty:
-            plt.figure(figsize=(12, 8))
-            plt.plot(namibia_data['Year'], namibia_data['Value'], marker='o', linewidth=2, color='orange')
-            global_avg = df.groupby('Year')['Value'].mean().reset_index()
-            plt.plot(global_avg['Year'], global_avg['Value'], marker='', linewidth=2, color='blue', alpha=0.7, linestyle='--')
-            plt.title('Namibia vs Global Average Connectivity Percentage')
-            plt.xlabel('Year')
-            plt.ylabel('Connectivity Percentage')
-            plt.legend(['Namibia', 'Global Average'])
-            
-            filename = os.path.join(PLOTS_DIR, 'namibia_trend.png')
-            plt.savefig(filename)
-            plt.close()
-            visualizations.append(filename)
-    except Exception as e:
-        logger.error(f"Error creating Namibia trend visualization: {e}")
+    namibia_data = select_country(df, 'Namibia')
+    if not namibia_data.empty:
+        ax.cla()
+        ax.plot(namibia_data['Year'], namibia_data['Value'], marker='o', linewidth=2, color='orange')
+        ax.plot(global_avg['Year'], global_avg['Value'], marker='', linewidth=2, color='blue', alpha=0.7, linestyle='--')
+        ax.set_title('Namibia vs Global Average Connectivity Percentage')
+        ax.set_xlabel('Year')
+        ax.set_ylabel('Connectivity Percentage')
+        ax.legend(['Namibia', 'Global Average'])
+        
+        filename = os.path.join(PLOTS_DIR, 'namibia_trend.png')
+        fig.savefig(filename)
+        visualizations.append(filename)
     
+    plt.close(fig)
     logger.info(f"Created {len(visualizations)} visualizations")
     return visualizations
 
@@ -106,8 +158,13 @@ def main():
         logger.error("Failed to load data. Exiting.")
         return
     
-    # Create visualizations
-    create_visualizations(df)
+    # Create visualizations; any plotting failure aborts the run here
+    try:
+        global_avg = compute_global_average(df)
+        create_visualizations(df, global_avg)
+    except Exception as e:
+        logger.error(f"Error creating visualizations: {e}")
+        return
     
     logger.info("EDA process completed successfully")
 
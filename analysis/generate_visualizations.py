@@ -10,24 +10,64 @@ Author: Jedidja
 """
 
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # Non-interactive backend; plots are only saved to disk
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
 import numpy as np
 from datetime import datetime
 
+# Skip interactive mode and simplify long line paths when rasterizing
+plt.ioff()
+plt.rcParams['path.simplify'] = True
+plt.rcParams['path.simplify_threshold'] = 1.0
+plt.rcParams['agg.path.chunksize'] = 10000
+
 # Set style
 sns.set(style="whitegrid")
 plt.rcParams["figure.figsize"] = (12, 8)
 
+# Single figure reused by every plot instead of allocating one per plot
+FIG, AX = plt.subplots()
+
 # Configuration
 INPUT_DIR = "data/processed"
 OUTPUT_DIR = "analysis/plots"
+PLOT_DPI = 100
+EMIT_SVG = os.environ.get("EMIT_SVG") == "1"  # SVG copies are opt-in
+
+# Only these columns are used downstream; years 2000-2024 fit in Int16,
+# which stays nullable because cleaning coerces bad years to NA
+COLUMNS = ['Country', 'Year', 'Value']
+DTYPES = {'Country': 'category', 'Year': 'Int16', 'Value': 'float32'}
 
 def ensure_output_dir():
     """Ensure the output directory exists"""
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+def reset_axes(figsize):
+    """Clear the shared axes and resize the figure for the next plot"""
+    AX.cla()
+    FIG.set_size_inches(*figsize)
+    return AX
+
+def save_figure(output_path):
+    """
+    Save the shared figure as PNG, plus an SVG copy if EMIT_SVG=1
+    
+    Plots are already laid out with tight_layout, so the extra render pass
+    of bbox_inches='tight' is not needed.
+    
+    Args:
+        output_path: Path of the PNG file to write
+    """
+    FIG.savefig(output_path, dpi=PLOT_DPI)
+    
+    # SVG needs a second render pass, so only write it when requested
+    if EMIT_SVG:
+        FIG.savefig(os.path.splitext(output_path)[0] + '.svg')
+
 def load_processed_data():
     """
     Load the latest processed data
@@ -35,40 +75,71 @@ def load_processed_data():
     Returns:
         Pandas DataFrame with processed data
     """
-    # Find the latest file by sorting filenames
-    files = [f for f in os.listdir(INPUT_DIR) if f.startswith('cleaned_data_') and f.endswith('.csv')]
-    if not files:
+    # Find the latest file by the lexicographically largest filename
+    latest_file = max(
+        (f for f in os.listdir(INPUT_DIR) if f.startswith('cleaned_data_') and f.endswith('.csv')),
+        default=None
+    )
+    if latest_file is None:
         print("No processed data files found")
         return None
     
-    latest_file = sorted(files)[-1]
     file_path = os.path.join(INPUT_DIR, latest_file)
+    parquet_path = os.path.splitext(file_path)[0] + '.parquet'
+    
+    # Prefer the typed parquet copy written alongside the CSV
+    if os.path.exists(parquet_path):
+        print(f"Loading processed data from {parquet_path}")
+        df = pd.read_parquet(parquet_path, columns=COLUMNS, dtype_backend='pyarrow').astype(DTYPES)
+    else:
+        print(f"Loading processed data from {file_path}")
+        df = pd.read_csv(file_path, engine='pyarrow', dtype_backend='pyarrow', usecols=COLUMNS, dtype=DTYPES)
     
-    print(f"Loading processed data from {file_path}")
-    df = pd.read_csv(file_path)
+    # Rows without a year cannot be placed on any plot
+    df = df.dropna(subset=['Year'])
     print(f"Loaded {len(df)} rows of processed data")
     
     return df
 
-def plot_global_trend(df):
+def compute_global_average(df):
+    """Calculate the global average connectivity value for each year"""
+    # Year is a small integer domain, so bin rows by their offset from the
+    # first year in a single unsorted pass instead of building a GroupBy
+    has_year = df['Year'].notna().to_numpy()
+    years = df['Year'].to_numpy(dtype=np.int64, na_value=0)[has_year]
+    values = df['Value'].to_numpy(dtype=float, na_value=np.nan)[has_year]
+    if years.size == 0:
+        return pd.DataFrame({'Year': years, 'Value': values})
+    
+    first_year = years.min()
+    offsets = years - first_year
+    present = np.bincount(offsets) > 0
+    valid = ~np.isnan(values)
+    sums = np.bincount(offsets, weights=np.where(valid, values, 0.0))
+    counts = np.bincount(offsets, weights=valid)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    return pd.DataFrame({'Year': np.flatnonzero(present) + first_year, 'Value': means[present]})
+
+def plot_global_trend(df, global_avg=None):
     """Create a plot showing global connectivity trend over time"""
     print("Creating global trend plot")
     
-    # Calculate global average by year
-    global_avg = df.groupby('Year')['Value'].mean().reset_index()
+    # Calculate global average by year unless already computed
+    if global_avg is None:
+        global_avg = compute_global_average(df)
     
-    plt.figure(figsize=(12, 6))
-    plt.plot(global_avg['Year'], global_avg['Value'], marker='o', linewidth=2)
-    plt.title('Global Internet Usage (% of Population) 2000-2024', fontsize=16)
-    plt.xlabel('Year', fontsize=12)
-    plt.ylabel('Internet Users (% of Population)', fontsize=12)
-    plt.grid(True, alpha=0.3)
-    plt.tight_layout()
+    ax = reset_axes((12, 6))
+    ax.plot(global_avg['Year'], global_avg['Value'], marker='o', linewidth=2)
+    ax.set_title('Global Internet Usage (% of Population) 2000-2024', fontsize=16)
+    ax.set_xlabel('Year', fontsize=12)
+    ax.set_ylabel('Internet Users (% of Population)', fontsize=12)
+    ax.grid(True, alpha=0.3)
+    FIG.tight_layout()
     
     # Save the plot
     output_path = os.path.join(OUTPUT_DIR, 'global_trend.png')
-    plt.savefig(output_path, dpi=300, bbox_inches='tight')
-    plt.close()
+    save_figure(output_path)
     print(f"Saved global trend plot to {output_path}")
 
 def plot_top_countries(df, year=2020, n=10):
@@ -80,36 +151,34 @@ def plot_top_countries(df, year=2020, n=10):
     if year_data.empty:
         print(f"No data available for year {year}")
         # Try to find the most recent year with data
-        available_years = sorted(df['Year'].unique())
-        if not available_years:
+        if df.empty:
             print("No data available for any year")
             return
-        year = available_years[-1]
+        year = df['Year'].max()
         year_data = df[df['Year'] == year].copy()
         print(f"Using most recent year with data: {year}")
     
     # Get top countries
-    top_countries = year_data.sort_values('Value', ascending=False).head(n)
+    top_countries = year_data.nlargest(n, 'Value')
     
-    plt.figure(figsize=(10, 8))
-    bars = plt.barh(top_countries['Country'], top_countries['Value'], color='skyblue')
-    plt.title(f'Top {n} Countries by Internet Usage (% of Population) in {year}', fontsize=16)
-    plt.xlabel('Internet Users (% of Population)', fontsize=12)
-    plt.ylabel('Country', fontsize=12)
-    plt.grid(True, alpha=0.3, axis='x')
+    ax = reset_axes((10, 8))
+    bars = ax.barh(top_countries['Country'], top_countries['Value'], color='skyblue')
+    ax.set_title(f'Top {n} Countries by Internet Usage (% of Population) in {year}', fontsize=16)
+    ax.set_xlabel('Internet Users (% of Population)', fontsize=12)
+    ax.set_ylabel('Country', fontsize=12)
+    ax.grid(True, alpha=0.3, axis='x')
     
     # Add value labels to the bars
     for bar in bars:
         width = bar.get_width()
-        plt.text(width + 1, bar.get_y() + bar.get_height()/2, f'{width:.1f}%', 
+        ax.text(width + 1, bar.get_y() + bar.get_height()/2, f'{width:.1f}%', 
                  ha='left', va='center', fontsize=10)
     
-    plt.tight_layout()
+    FIG.tight_layout()
     
     # Save the plot
     output_path = os.path.join(OUTPUT_DIR, f'top_countries_{year}.png')
-    plt.savefig(output_path, dpi=300, bbox_inches='tight')
-    plt.close()
+    save_figure(output_path)
     print(f"Saved top countries plot to {output_path}")
 
 def plot_regional_comparison(df, year=2020):
@@ -131,44 +200,47 @@ def plot_regional_comparison(df, year=2020):
     if year_data.empty:
         print(f"No data available for year {year}")
         # Try to find the most recent year with data
-        available_years = sorted(df['Year'].unique())
-        if not available_years:
+        if df.empty:
             print("No data available for any year")
             return
-        year = available_years[-1]
+        year = df['Year'].max()
         year_data = df[df['Year'] == year].copy()
         print(f"Using most recent year with data: {year}")
     
-    # Calculate regional averages
-    regional_avgs = []
-    for region, countries in regions.items():
-        region_data = year_data[year_data['Country'].isin(countries)]
-        if not region_data.empty:
-            avg = region_data['Value'].mean()
-            regional_avgs.append({'Region': region, 'Value': avg})
-    
-    regional_df = pd.DataFrame(regional_avgs)
+    # Calculate regional averages with one join and one aggregation,
+    # keeping regions in definition order and skipping those without data
+    region_map = pd.DataFrame(
+        [(country, region) for region, countries in regions.items() for country in countries],
+        columns=['Country', 'Region']
+    )
+    regional_df = (
+        year_data.dropna(subset=['Value'])
+        .merge(region_map, on='Country')
+        .groupby('Region')['Value'].mean()
+        .reindex(list(regions))
+        .dropna()
+        .reset_index()
+    )
     
-    plt.figure(figsize=(10, 6))
-    bars = plt.bar(regional_df['Region'], regional_df['Value'], color=sns.color_palette("viridis", len(regional_df)))
-    plt.title(f'Regional Comparison of Internet Usage (% of Population) in {year}', fontsize=16)
-    plt.xlabel('Region', fontsize=12)
-    plt.ylabel('Internet Users (% of Population)', fontsize=12)
-    plt.grid(True, alpha=0.3, axis='y')
-    plt.xticks(rotation=45)
+    ax = reset_axes((10, 6))
+    bars = ax.bar(regional_df['Region'], regional_df['Value'], color=sns.color_palette("viridis", len(regional_df)))
+    ax.set_title(f'Regional Comparison of Internet Usage (% of Population) in {year}', fontsize=16)
+    ax.set_xlabel('Region', fontsize=12)
+    ax.set_ylabel('Internet Users (% of Population)', fontsize=12)
+    ax.grid(True, alpha=0.3, axis='y')
+    ax.tick_params(axis='x', labelrotation=45)
     
     # Add value labels to the bars
     for bar in bars:
         height = bar.get_height()
-        plt.text(bar.get_x() + bar.get_width()/2, height + 1, f'{height:.1f}%', 
+        ax.text(bar.get_x() + bar.get_width()/2, height + 1, f'{height:.1f}%', 
                  ha='center', va='bottom', fontsize=10)
     
-    plt.tight_layout()
+    FIG.tight_layout()
     
     # Save the plot
     output_path = os.path.join(OUTPUT_DIR, f'regional_comparison_{year}.png')
-    plt.savefig(output_path, dpi=300, bbox_inches='tight')
-    plt.close()
+    save_figure(output_path)
     print(f"Saved regional comparison plot to {output_path}")
 
 def main():
@@ -186,14 +258,13 @@ def main():
         return
     
     # Create visualizations
-    plot_global_trend(df)
+    global_avg = compute_global_average(df)
+    plot_global_trend(df, global_avg)
     
     # Find the most recent year with data
-    available_years = sorted(df['Year'].unique())
-    if available_years:
-        recent_year = available_years[-1]
-        plot_top_countries(df, year=recent_year)
-        plot_regional_comparison(df, year=recent_year)
+    recent_year = df['Year'].max()
+    plot_top_countries(df, year=recent_year)
+    plot_regional_comparison(df, year=recent_year)
     
     print("Visualization generation process completed successfully")
 
@@ -11,6 +11,9 @@ Author: Jedidja
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pac
 import os
 import logging
 from datetime import datetime
@@ -23,9 +26,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Enable copy-on-write so shallow copies only duplicate columns that change
+# (always on from pandas 3.0, where the option is deprecated)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.options.mode.copy_on_write = True
+
 # Configuration
 INPUT_DIR = "../data/raw"
 OUTPUT_DIR = "../data/processed"
+EMIT_JSON = os.environ.get("EMIT_JSON") == "1"  # JSON output is opt-in
 
 def load_raw_data():
     """
@@ -35,13 +44,21 @@ def load_raw_data():
         Pandas DataFrame with raw data
     """
     latest_file = os.path.join(INPUT_DIR, "raw_data_latest.csv")
+    parquet_file = os.path.join(INPUT_DIR, "raw_data_latest.parquet")
+    
+    # Prefer the typed parquet copy written by the fetch step
+    if os.path.exists(parquet_file):
+        logger.info(f"Loading raw data from {parquet_file}")
+        df = pd.read_parquet(parquet_file, dtype_backend='pyarrow')
+        logger.info(f"Loaded {len(df)} rows of raw data")
+        return df
     
     if not os.path.exists(latest_file):
         logger.error(f"Raw data file not found: {latest_file}")
         return None
     
     logger.info(f"Loading raw data from {latest_file}")
-    df = pd.read_csv(latest_file)
+    df = pd.read_csv(latest_file, engine='pyarrow', dtype_backend='pyarrow')
     logger.info(f"Loaded {len(df)} rows of raw data")
     
     return df
@@ -62,21 +79,22 @@ def clean_data(df):
     
     logger.info("Starting data cleaning process")
     
-    # Make a copy to avoid modifying the original
-    cleaned_df = df.copy()
+    # Shallow copy to avoid modifying the original; copy-on-write defers
+    # duplicating column data until a column is actually written
+    cleaned_df = df.copy(deep=False)
     
     # 1. Handle missing values
     logger.info("Handling missing values")
-    missing_before = cleaned_df.isna().sum().sum()
+    missing_per_col = cleaned_df.isna().sum()
+    missing_before = missing_per_col.sum()
     
     # Fill missing country names with 'Unknown'
     cleaned_df['Country'] = cleaned_df['Country'].fillna('Unknown')
+    missing_per_col['Country'] = 0
     
     # Log missing values by column
-    for col in cleaned_df.columns:
-        missing_count = cleaned_df[col].isna().sum()
-        if missing_count > 0:
-            logger.info(f"Column '{col}' has {missing_count} missing values ({missing_count/len(cleaned_df)*100:.2f}%)")
+    for col, missing_count in missing_per_col[missing_per_col > 0].items():
+        logger.info(f"Column '{col}' has {missing_count} missing values ({missing_count/len(cleaned_df)*100:.2f}%)")
     
     # 2. Standardize country names
     logger.info("Standardizing country names")
@@ -101,8 +119,16 @@ def clean_data(df):
         'Macao SAR, China': 'Macao'
     }
     
-    # Apply country name standardization
-    cleaned_df['Country'] = cleaned_df['Country'].replace(country_mapping)
+    # Apply country name standardization with Arrow kernels: look up each
+    # name's position in the mapping keys, take the replacement and keep
+    # the original name where there is no match
+    countries = pa.array(cleaned_df['Country'])
+    positions = pc.index_in(countries, value_set=pa.array(list(country_mapping.keys()), type=countries.type))
+    replacements = pc.take(pa.array(list(country_mapping.values()), type=countries.type), positions)
+    standardized = pc.coalesce(replacements, countries)
+    cleaned_df['Country'] = pd.Series(
+        pd.arrays.ArrowExtensionArray(standardized), index=cleaned_df.index
+    ).astype(cleaned_df['Country'].dtype)
     
     # 3. Convert percentages to numeric
     logger.info("Converting values to numeric")
@@ -142,9 +168,34 @@ def clean_data(df):
     
     return cleaned_df
 
+def remove_file(filename):
+    """Remove a file, ignoring it if it does not exist"""
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+def link_latest(filename, latest_filename):
+    """
+    Point a fixed "latest" filename at a timestamped output file
+    
+    Uses a hard link where possible and falls back to a symlink, so the
+    data is only serialized once.
+    
+    Args:
+        filename: Path of the timestamped file
+        latest_filename: Path of the fixed-name reference
+    """
+    remove_file(latest_filename)
+    
+    try:
+        os.link(filename, latest_filename)
+    except OSError:
+        os.symlink(os.path.basename(filename), latest_filename)
+
 def save_cleaned_data(df):
     """
-    Save cleaned data to CSV and JSON files
+    Save cleaned data to CSV and Parquet files (and JSON if EMIT_JSON=1)
     
     Args:
         df: Pandas DataFrame with cleaned data
@@ -156,15 +207,26 @@ def save_cleaned_data(df):
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     csv_filename = os.path.join(OUTPUT_DIR, f"cleaned_data_{timestamp}.csv")
     json_filename = os.path.join(OUTPUT_DIR, f"cleaned_data_{timestamp}.json")
-    
-    logger.info(f"Saving cleaned data to {csv_filename} and {json_filename}")
-    
-    df.to_csv(csv_filename, index=False)
-    df.to_json(json_filename, orient='records')
-    
-    # Also save a copy with a fixed name for easier reference
-    df.to_csv(os.path.join(OUTPUT_DIR, "cleaned_data_latest.csv"), index=False)
-    df.to_json(os.path.join(OUTPUT_DIR, "cleaned_data_latest.json"), orient='records')
+    parquet_filename = os.path.join(OUTPUT_DIR, f"cleaned_data_{timestamp}.parquet")
+    
+    logger.info(f"Saving cleaned data to {csv_filename} and {parquet_filename}")
+    
+    # Arrow's multithreaded C++ writer is much faster than DataFrame.to_csv
+    pac.write_csv(pa.Table.from_pandas(df, preserve_index=False), csv_filename)
+    df.to_parquet(parquet_filename, index=False, compression='zstd')
+    
+    # Also link a fixed name to each file for easier reference
+    link_latest(csv_filename, os.path.join(OUTPUT_DIR, "cleaned_data_latest.csv"))
+    link_latest(parquet_filename, os.path.join(OUTPUT_DIR, "cleaned_data_latest.parquet"))
+    
+    # JSON is only written when requested with EMIT_JSON=1
+    if EMIT_JSON:
+        logger.info(f"Saving cleaned data to {json_filename}")
+        df.to_json(json_filename, orient='records')
+        link_latest(json_filename, os.path.join(OUTPUT_DIR, "cleaned_data_latest.json"))
+    else:
+        # Don't leave an older run's JSON looking like the latest output
+        remove_file(os.path.join(OUTPUT_DIR, "cleaned_data_latest.json"))
     
     logger.info("Cleaned data saved successfully")
 
@@ -11,7 +11,12 @@ Author: Jedidja
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pac
 import json
 import os
 from datetime import datetime
@@ -29,6 +34,8 @@ logger = logging.getLogger(__name__)
 BASE_URL = "https://api.worldbank.org/v2"
 DATASET_ID = "ITU"  # As specified in the requirements
 OUTPUT_DIR = "../data/raw"
+EMIT_JSON = os.environ.get("EMIT_JSON") == "1"  # JSON output is opt-in
+MAX_WORKERS = 8  # Concurrent page requests
 
 def ensure_output_dir():
     """Ensure the output directory exists"""
@@ -80,10 +87,39 @@ def discover_indicator_id():
         logger.info("Using fallback indicator ID: IT.NET.USER.ZS")
         return "IT.NET.USER.ZS"
 
+def create_session():
+    """Create a requests session that can reuse a connection per worker"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def fetch_page(session, endpoint, params, page):
+    """
+    Fetch a single page of indicator data
+    
+    Args:
+        session: requests Session used for the request
+        endpoint: API endpoint to query
+        params: Query parameters shared by every page
+        page: Page number to fetch
+        
+    Returns:
+        Decoded JSON response (metadata followed by the data list)
+    """
+    logger.info(f"Making API request with page={page}, per_page={params['per_page']}")
+    response = session.get(endpoint, params={**params, "page": page})
+    response.raise_for_status()
+    return response.json()
+
 def fetch_data(indicator_id, start_year=2000, end_year=2024):
     """
     Fetch global data for the specified indicator and year range
     
+    The first page is fetched on its own to read the total page count from
+    the response metadata; the remaining pages are fetched concurrently.
+    
     Args:
         indicator_id: The indicator ID to fetch data for
         start_year: Start year for data (default: 2000)
@@ -97,44 +133,52 @@ def fetch_data(indicator_id, start_year=2000, end_year=2024):
     endpoint = f"{BASE_URL}/countries/all/indicators/{indicator_id}"
     
     all_data = []
-    page = 1
     per_page = 1000  # Maximum records per request
+    params = {
+        "format": "json",
+        "date": f"{start_year}:{end_year}",
+        "per_page": per_page
+    }
     
-    while True:
-        params = {
-            "format": "json",
-            "date": f"{start_year}:{end_year}",
-            "per_page": per_page,
-            "page": page
-        }
-        
+    with create_session() as session:
         try:
-            logger.info(f"Making API request with page={page}, per_page={per_page}")
-            response = requests.get(endpoint, params=params)
-            response.raise_for_status()
-            
             # World Bank API returns a list where the first element is metadata and second is data
-            response_data = response.json()
-            
-            # Check if we have data (second element in the response)
-            if len(response_data) < 2 or not response_data[1]:
-                logger.info("No more data to fetch")
-                break
-                
-            data_batch = response_data[1]
-            all_data.extend(data_batch)
-            logger.info(f"Fetched {len(data_batch)} records. Total records: {len(all_data)}")
-            
-            # Check if we've reached the last page
-            if len(data_batch) < per_page:
-                logger.info("Reached end of data")
-                break
-                
-            page += 1
-            
+            response_data = fetch_page(session, endpoint, params, 1)
         except requests.exceptions.RequestException as e:
             logger.error(f"Error fetching data: {e}")
-            break
+            return all_data
+        
+        # Check if we have data (second element in the response)
+        if len(response_data) < 2 or not response_data[1]:
+            logger.info("No more data to fetch")
+            return all_data
+        
+        all_data.extend(response_data[1])
+        total_pages = int(response_data[0].get("pages", 1))
+        logger.info(f"Fetched {len(response_data[1])} records. Total records: {len(all_data)}, total pages: {total_pages}")
+        
+        if total_pages <= 1:
+            logger.info("Reached end of data")
+            return all_data
+        
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            pages = executor.map(
+                lambda page: fetch_page(session, endpoint, params, page),
+                range(2, total_pages + 1)
+            )
+            
+            # Results arrive in page order; stop at the first failed page
+            try:
+                for response_data in pages:
+                    if len(response_data) < 2 or not response_data[1]:
+                        logger.info("No more data to fetch")
+                        break
+                    
+                    data_batch = response_data[1]
+                    all_data.extend(data_batch)
+                    logger.info(f"Fetched {len(data_batch)} records. Total records: {len(all_data)}")
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Error fetching data: {e}")
     
     return all_data
 
@@ -150,26 +194,24 @@ def normalize_data(raw_data):
     """
     logger.info("Normalizing data into DataFrame")
     
-    normalized_data = []
+    columns = {
+        'country.value': 'Country',
+        'countryiso3code': 'Country_Code',
+        'date': 'Year',
+        'value': 'Value',
+        'indicator.value': 'Indicator',
+        'indicator.id': 'Indicator_Code'
+    }
+    
+    df = pd.json_normalize(raw_data).rename(columns=columns)
+    df = df.reindex(columns=list(columns.values()))
     
-    for item in raw_data:
-        try:
-            record = {
-                'Country': item.get('country', {}).get('value', 'Unknown'),
-                'Country_Code': item.get('countryiso3code', 'Unknown'),
-                'Year': item.get('date', 'Unknown'),
-                'Value': item.get('value', None),
-                'UNIT_MEASURE': 'Percentage',
-                'OBS_STATUS': 'Regular' if item.get('value') is not None else 'Missing',
-                'Indicator': item.get('indicator', {}).get('value', 'Unknown'),
-                'Indicator_Code': item.get('indicator', {}).get('id', 'Unknown')
-            }
-            normalized_data.append(record)
-        except Exception as e:
-            logger.error(f"Error normalizing data point: {e}")
-            logger.error(f"Problematic data point: {item}")
-    
-    df = pd.DataFrame(normalized_data)
+    # Fill missing descriptive fields the same way as absent keys
+    text_columns = ['Country', 'Country_Code', 'Year', 'Indicator', 'Indicator_Code']
+    df[text_columns] = df[text_columns].fillna('Unknown')
+    
+    df.insert(4, 'UNIT_MEASURE', 'Percentage')
+    df.insert(5, 'OBS_STATUS', np.where(df['Value'].notna(), 'Regular', 'Missing'))
     
     # Basic data type conversions
     try:
@@ -185,9 +227,34 @@ def normalize_data(raw_data):
     logger.info(f"Normalized data into DataFrame with {len(df)} rows and {len(df.columns)} columns")
     return df
 
+def remove_file(filename):
+    """Remove a file, ignoring it if it does not exist"""
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+def link_latest(filename, latest_filename):
+    """
+    Point a fixed "latest" filename at a timestamped output file
+    
+    Uses a hard link where possible and falls back to a symlink, so the
+    data is only serialized once.
+    
+    Args:
+        filename: Path of the timestamped file
+        latest_filename: Path of the fixed-name reference
+    """
+    remove_file(latest_filename)
+    
+    try:
+        os.link(filename, latest_filename)
+    except OSError:
+        os.symlink(os.path.basename(filename), latest_filename)
+
 def save_raw_data(df, indicator_id):
     """
-    Save raw data to CSV and JSON files
+    Save raw data to CSV and Parquet files (and JSON if EMIT_JSON=1)
     
     Args:
         df: Pandas DataFrame with normalized data
@@ -198,15 +265,26 @@ def save_raw_data(df, indicator_id):
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     csv_filename = os.path.join(OUTPUT_DIR, f"raw_data_{indicator_id}_{timestamp}.csv")
     json_filename = os.path.join(OUTPUT_DIR, f"raw_data_{indicator_id}_{timestamp}.json")
+    parquet_filename = os.path.join(OUTPUT_DIR, f"raw_data_{indicator_id}_{timestamp}.parquet")
+    
+    logger.info(f"Saving raw data to {csv_filename} and {parquet_filename}")
     
-    logger.info(f"Saving raw data to {csv_filename} and {json_filename}")
+    # Arrow's multithreaded C++ writer is much faster than DataFrame.to_csv
+    pac.write_csv(pa.Table.from_pandas(df, preserve_index=False), csv_filename)
+    df.to_parquet(parquet_filename, index=False, compression='zstd')
     
-    df.to_csv(csv_filename, index=False)
-    df.to_json(json_filename, orient='records')
+    # Also link a fixed name to each file for easier reference
+    link_latest(csv_filename, os.path.join(OUTPUT_DIR, "raw_data_latest.csv"))
+    link_latest(parquet_filename, os.path.join(OUTPUT_DIR, "raw_data_latest.parquet"))
     
-    # Also save a copy with a fixed name for easier reference
-    df.to_csv(os.path.join(OUTPUT_DIR, "raw_data_latest.csv"), index=False)
-    df.to_json(os.path.join(OUTPUT_DIR, "raw_data_latest.json"), orient='records')
+    # JSON is only written when requested with EMIT_JSON=1
+    if EMIT_JSON:
+        logger.info(f"Saving raw data to {json_filename}")
+        df.to_json(json_filename, orient='records')
+        link_latest(json_filename, os.path.join(OUTPUT_DIR, "raw_data_latest.json"))
+    else:
+        # Don't leave an older run's JSON looking like the latest output
+        remove_file(os.path.join(OUTPUT_DIR, "raw_data_latest.json"))
     
     logger.info("Raw data saved successfully")
 